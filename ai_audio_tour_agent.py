@@ -1,14 +1,28 @@
 import streamlit as st
 import asyncio
+import re
+import unicodedata
 from manager import TourManager
 from agents import set_default_openai_key
-import json
+
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+def _slug(text: str) -> str:
+    """Filesystem-safe name: accents stripped, lowercase, underscores."""
+    ascii_text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    return _SLUG_RE.sub('_', ascii_text.lower()).strip('_')[:40]
+
+@st.cache_resource
+def get_openai_client(api_key):
+    """One client (and connection pool) per API key, shared across reruns."""
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key)
 
 def tts(text):
     from pathlib import Path
-    from openai import OpenAI
 
-    client = OpenAI()
+    client = get_openai_client(st.session_state.get("OPENAI_API_KEY"))
     speech_file_path = Path(__file__).parent / f"speech_tour.mp3"
         
     response = client.audio.speech.create(
@@ -106,31 +120,30 @@ if st.button("🎧 Generate Tour", type="primary"):
     elif not interests:
         st.error("Please select at least one interest.")
     else:
-        with st.spinner(f"Creating your personalized tour of {location}..."):
+        # A single status container, updated only at real state transitions
+        with st.status(f"Creating your personalized tour of {location}...") as status:
             mgr = TourManager()
             final_tour = run_async(
                 mgr.run, location, interests, duration
             )
 
-            # Display the tour content in an expandable section
-            with st.expander("📝 Tour Content", expanded=True):
-                st.markdown(final_tour)
-            
-            # Add a progress bar for audio generation
-            with st.spinner("🎙️ Generating audio tour..."):
-                progress_bar = st.progress(0)
-                tour_audio = tts(final_tour)
-                progress_bar.progress(100)
-            
-            # Display audio player with custom styling
-            st.markdown("### 🎧 Listen to Your Tour")
-            st.audio(tour_audio, format="audio/mp3")
-            
-            # Add download button for the audio
-            with open(tour_audio, "rb") as file:
-                st.download_button(
-                    label="📥 Download Audio Tour",
-                    data=file,
-                    file_name=f"{location.lower().replace(' ', '_')}_tour.mp3",
-                    mime="audio/mp3"
-                )
\ No newline at end of file
+            status.update(label="🎙️ Generating audio tour...")
+            tour_audio = tts(final_tour)
+            status.update(label="✅ Your tour is ready!", state="complete")
+
+        # Display the tour content in an expandable section
+        with st.expander("📝 Tour Content", expanded=True):
+            st.markdown(final_tour)
+
+        # Display audio player with custom styling
+        st.markdown("### 🎧 Listen to Your Tour")
+        st.audio(tour_audio, format="audio/mp3")
+        
+        # Add download button for the audio
+        with open(tour_audio, "rb") as file:
+            st.download_button(
+                label="📥 Download Audio Tour",
+                data=file,
+                file_name=f"{_slug(location)}_tour.mp3",
+                mime="audio/mp3"
+            )
\ No newline at end of file
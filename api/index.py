@@ -2,15 +2,19 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 
+# La respuesta es estática: se serializa una sola vez al importar el módulo
+_BODY = json.dumps({
+    'status': 'ok',
+    'message': 'API is running',
+    'version': '1.0.0'
+}).encode()
+_LEN = str(len(_BODY))
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', _LEN)
         self.end_headers()
-        response = {
-            'status': 'ok',
-            'message': 'API is running',
-            'version': '1.0.0'
-        }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(_BODY)
         return
@@ -1,16 +1,50 @@
 import streamlit as st
 from supabase_manager import SupabaseManager
-import os
+import re
 from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z')
+
+# Número de usuarios por página en el panel de administración
+ADMIN_PAGE_SIZE = 50
+
+
+@st.cache_resource
+def _supabase_singleton() -> SupabaseManager:
+    """Cliente de Supabase compartido por todos los reruns y sesiones."""
+    return SupabaseManager()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_token_status(_supabase: SupabaseManager, email: str) -> dict:
+    """
+    Uso de tokens de un usuario, cacheado entre reruns.
+    
+    Se invalida con `cached_token_status.clear()` después de registrar consumo.
+    """
+    return _supabase.check_token_usage(email)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_admin_snapshot(_supabase: SupabaseManager, offset: int = 0,
+                           limit: Optional[int] = None, search: Optional[str] = None) -> dict:
+    """
+    Página de la whitelist y solicitudes pendientes, cacheadas entre reruns.
+    
+    La caché es del proceso y la comparten todas las sesiones de administración:
+    tras cualquier modificación se vacía con `_cached_admin_snapshot.clear()`.
+    """
+    return _supabase.get_admin_snapshot(offset=offset, limit=limit, search=search)
+
+
 class AuthManager:
     """Gestor de autenticación y autorización."""
 
     def __init__(self):
-        self.supabase = SupabaseManager()
+        self.supabase = _supabase_singleton()
 
     def show_login_form(self) -> Optional[str]:
         """
@@ -28,7 +62,7 @@ class AuthManager:
                 "📧 Email",
                 placeholder="tu.email@ejemplo.com",
                 help="Ingresa tu email para verificar acceso"
-            )
+            ).strip().lower()
 
             submitted = st.form_submit_button("🔓 Acceder", use_container_width=True)
 
@@ -41,8 +75,10 @@ class AuthManager:
                     st.error("❌ Por favor ingresa un email válido")
                     return None
 
-                # Verificar el estado del correo en la lista blanca
-                user_status = self.supabase.check_email_in_whitelist(email)
+                # Verificar el acceso y crear la solicitud si no existe (una sola llamada).
+                # No se cachea: la llamada inserta solicitudes y un error pasajero
+                # no debe quedarse guardado como respuesta.
+                user_status = self.supabase.login_or_request(email)
                 
                 # Si el usuario existe y está activo, permitir acceso
                 if user_status["exists"] and user_status["is_active"]:
@@ -53,35 +89,18 @@ class AuthManager:
                     st.rerun()
                     return email
                 
+                # Si el usuario no existía, se acaba de crear su solicitud
+                elif user_status.get("created"):
+                    st.success("✅ Solicitud de acceso creada correctamente. Un administrador la revisará pronto.")
+                    return None
+                
                 # Si el usuario existe pero está inactivo (pendiente de aprobación)
-                elif user_status["exists"] and not user_status["is_active"]:
+                elif user_status["exists"]:
                     st.warning("⏳ Tu cuenta está pendiente de aprobación. Te notificaremos por correo cuando tu acceso sea aprobado.")
                     return None
                 
-                # Si el usuario no existe, crear una nueva solicitud
                 else:
-                    st.info("📨 No estás en la lista de acceso. Creando una solicitud...")
-                    request_result = self.supabase.request_access(email)
-                    
-                    # Manejar diferentes tipos de respuesta
-                    if isinstance(request_result, dict):
-                        if request_result.get("success"):
-                            if request_result.get("status") == "pending":
-                                st.success("✅ " + request_result.get("message", "Solicitud enviada correctamente."))
-                            elif request_result.get("status") == "active":
-                                st.success("✅ " + request_result.get("message", "Tu cuenta ya está activa."))
-                            else:
-                                st.success("✅ " + request_result.get("message", "Solicitud procesada correctamente."))
-                        else:
-                            error_msg = request_result.get("message", "Error al procesar tu solicitud. Intenta nuevamente.")
-                            st.error(f"❌ {error_msg}")
-                    else:
-                        # Manejar el caso en que request_result es un booleano
-                        if request_result:
-                            st.success("✅ Solicitud procesada correctamente.")
-                        else:
-                            st.error("❌ Error al procesar tu solicitud. Por favor, inténtalo de nuevo o contacta al administrador.")
-                    
+                    st.error("❌ Error al procesar tu solicitud. Por favor, inténtalo de nuevo o contacta al administrador.")
                     return None
 
         return None
@@ -89,135 +108,191 @@ class AuthManager:
         """Muestra el panel de administración para gestionar la whitelist."""
         st.title("👨‍💼 Panel de Administración")
 
-        tab1, tab2, tab3, tab4 = st.tabs([
-            "👥 Ver Usuarios", 
-            "➕ Agregar Usuario", 
-            "⏳ Solicitudes Pendientes",
-            "🗑️ Remover Usuario"
-        ])
-
-        with tab1:
-            st.subheader("Usuarios Autorizados")
-            users = self.supabase.get_all_whitelist_emails()
-
-            if users:
-                # Pre-procesar los datos para el dataframe
-                display_users = []
-                for user in users:
-                    display_users.append({
-                        "📧 Email": user.get("email", ""),
-                        "👤 Rol": "Administrador" if user.get("role") == "admin" else "Usuario",
-                        "✅ Activo": "Sí" if user.get("is_active") else "No"
-                    })
-                
-                st.dataframe(
-                    display_users,
-                    use_container_width=True,
-                    hide_index=True
-                )
-                
-                # Opción para eliminar usuarios
-                with st.expander("❌ Eliminar Usuario"):
-                    email_to_remove = st.selectbox(
-                        "Selecciona un email para eliminar",
-                        [""] + [user["📧 Email"] for user in display_users],
-                        format_func=lambda x: x if x else "Selecciona un email"
-                    )
-                    
-                    if st.button("Eliminar Usuario", type="primary", use_container_width=True):
-                        if email_to_remove:
-                            if self.supabase.remove_email_from_whitelist(email_to_remove):
-                                st.success(f"✅ {email_to_remove} eliminado exitosamente")
-                                st.rerun()
-                            else:
-                                st.error(f"❌ Error al eliminar {email_to_remove}")
-                        else:
-                            st.warning("Por favor ingresa un email para eliminar")
-            else:
-                st.info("ℹ️ No hay usuarios autorizados")
-
-        with tab2:
-            st.subheader("Agregar Nuevo Usuario")
-            with st.form("add_user_form"):
-                new_email = st.text_input("📧 Email del nuevo usuario")
-                role = st.selectbox(
-                    "👤 Rol", 
-                    ["user", "admin"], 
-                    format_func=lambda x: "Usuario" if x == "user" else "Administrador"
-                )
-                
-                submitted = st.form_submit_button("➕ Agregar Usuario", type="primary", use_container_width=True)
+        # El rol se guarda en la sesión al iniciar sesión, no hace falta consultarlo
+        if not st.session_state.get("is_admin"):
+            st.error("❌ No tienes permisos para acceder a esta sección.")
+            return
 
-                if submitted:
-                    if not new_email:
-                        st.error("❌ Por favor ingresa un email")
-                    elif not self._is_valid_email(new_email):
-                        st.error("❌ Por favor ingresa un email válido")
+        # Paginación y búsqueda en el servidor: solo se trae la página visible
+        col_search, col_page = st.columns([3, 1])
+        with col_search:
+            search = st.text_input("🔍 Buscar email", key="admin_search").strip() or None
+        with col_page:
+            page = st.number_input("Página", min_value=1, value=1, step=1, key="admin_page")
+        offset = (int(page) - 1) * ADMIN_PAGE_SIZE
+
+        # Navegación con radio en lugar de st.tabs: solo se ejecuta la sección visible
+        section = st.radio(
+            "Sección",
+            [
+                "👥 Ver Usuarios", 
+                "➕ Agregar Usuario", 
+                "⏳ Solicitudes Pendientes",
+                "🗑️ Remover Usuario"
+            ],
+            horizontal=True,
+            label_visibility="collapsed",
+            key="admin_section"
+        )
+
+        # Cada sección es un fragmento: tras una modificación solo se vuelve a ejecutar esa sección
+        if section == "👥 Ver Usuarios":
+            self._tab_users(offset, search)
+        elif section == "➕ Agregar Usuario":
+            self._tab_add_user()
+        elif section == "⏳ Solicitudes Pendientes":
+            self._tab_pending(offset, search)
+        else:
+            self._tab_remove_user(offset, search)
+
+    @st.fragment
+    def _tab_users(self, offset: int, search: Optional[str]):
+        """Pestaña con la tabla de usuarios autorizados."""
+        st.subheader("Usuarios Autorizados")
+        users = self._admin_snapshot(offset, search)["users"]
+
+        if users:
+            # Pre-procesar los datos para el dataframe
+            display_users = []
+            for user in users:
+                display_users.append({
+                    "📧 Email": user.get("email", ""),
+                    "👤 Rol": "Administrador" if user.get("role") == "admin" else "Usuario",
+                    "✅ Activo": "Sí" if user.get("is_active") else "No"
+                })
+            
+            # Una sola tabla con selección de filas en lugar de un widget por usuario
+            table = st.dataframe(
+                display_users,
+                use_container_width=True,
+                hide_index=True,
+                key="whitelist_table",
+                on_select="rerun",
+                selection_mode="multi-row"
+            )
+            selected_emails = [display_users[row]["📧 Email"] for row in table.selection.rows]
+            
+            if st.button("❌ Eliminar seleccionados", type="primary", use_container_width=True):
+                if selected_emails:
+                    if self.supabase.remove_emails_bulk(selected_emails):
+                        st.success(f"✅ {len(selected_emails)} usuario(s) eliminado(s) exitosamente")
+                        self._invalidate_whitelist()
+                    else:
+                        st.error("❌ Error al eliminar los usuarios seleccionados")
+                else:
+                    st.warning("Por favor selecciona al menos un usuario para eliminar")
+        else:
+            st.info("ℹ️ No hay usuarios autorizados")
+
+    @st.fragment
+    def _tab_add_user(self):
+        """Pestaña con el formulario para agregar usuarios."""
+        st.subheader("Agregar Nuevo Usuario")
+        with st.form("add_user_form"):
+            new_email = st.text_input("📧 Email del nuevo usuario").strip().lower()
+            role = st.selectbox(
+                "👤 Rol", 
+                ["user", "admin"], 
+                format_func=lambda x: "Usuario" if x == "user" else "Administrador"
+            )
+            
+            submitted = st.form_submit_button("➕ Agregar Usuario", type="primary", use_container_width=True)
+
+            if submitted:
+                if not new_email:
+                    st.error("❌ Por favor ingresa un email")
+                elif not self._is_valid_email(new_email):
+                    st.error("❌ Por favor ingresa un email válido")
+                else:
+                    if self.supabase.add_email_to_whitelist(new_email, role):
+                        st.success(f"✅ {new_email} agregado exitosamente como {'Administrador' if role == 'admin' else 'Usuario'}")
+                        self._invalidate_whitelist()
                     else:
-                        if self.supabase.add_email_to_whitelist(new_email, role):
-                            st.success(f"✅ {new_email} agregado exitosamente como {'Administrador' if role == 'admin' else 'Usuario'}")
-                            st.rerun()
-                        else:
-                            st.error(f"❌ Error al agregar {new_email}")
-
-        with tab3:
-            st.subheader("Solicitudes de Acceso Pendientes")
-            pending_users = self.supabase.get_pending_approvals()
-
-            if not pending_users:
-                st.info("ℹ️ No hay solicitudes pendientes.")
+                        st.error(f"❌ Error al agregar {new_email}")
+
+    @st.fragment
+    def _tab_pending(self, offset: int, search: Optional[str]):
+        """Pestaña con las solicitudes de acceso pendientes."""
+        st.subheader("Solicitudes de Acceso Pendientes")
+        pending_users = self._admin_snapshot(offset, search)["pending"]
+
+        if not pending_users:
+            st.info("ℹ️ No hay solicitudes pendientes.")
+            return
+
+        with st.form("pending_users_form"):
+            selected = []
+            for user in pending_users:
+                email = user['email']
+                if st.checkbox(f"📧 {email}", key=f"pending_{email}"):
+                    selected.append(email)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                approve = st.form_submit_button("✅ Aceptar seleccionados", use_container_width=True)
+            with col2:
+                reject = st.form_submit_button("❌ Rechazar seleccionados", use_container_width=True)
+
+        if approve or reject:
+            if not selected:
+                st.warning("Por favor selecciona al menos una solicitud")
+            elif approve:
+                if self.supabase.approve_users_bulk(selected):
+                    st.success(f"✅ {len(selected)} usuario(s) aprobado(s).")
+                    self._invalidate_whitelist()
+                else:
+                    st.error("❌ Error al aprobar las solicitudes seleccionadas.")
             else:
-                for user in pending_users:
-                    email = user['email']
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    with col1:
-                        st.write(f"📧 {email}")
-                    with col2:
-                        if st.button("✅ Aceptar", key=f"approve_{email}", use_container_width=True):
-                            if self.supabase.approve_user(email):
-                                st.success(f"✅ {email} ha sido aprobado.")
-                                st.rerun()
-                            else:
-                                st.error(f"❌ Error al aprobar a {email}.")
-                    with col3:
-                        if st.button("❌ Rechazar", key=f"reject_{email}", use_container_width=True):
-                            if self.supabase.reject_user(email):
-                                st.success(f"🗑️ Solicitud de {email} rechazada.")
-                                st.rerun()
-                            else:
-                                st.error(f"❌ Error al rechazar a {email}.")
-
-        with tab4:
-            st.subheader("Remover Usuario")
-            users = self.supabase.get_all_whitelist_emails()
+                if self.supabase.reject_users_bulk(selected):
+                    st.success(f"🗑️ {len(selected)} solicitud(es) rechazada(s).")
+                    self._invalidate_whitelist()
+                else:
+                    st.error("❌ Error al rechazar las solicitudes seleccionadas.")
+
+    @st.fragment
+    def _tab_remove_user(self, offset: int, search: Optional[str]):
+        """Pestaña para remover un usuario de la whitelist."""
+        st.subheader("Remover Usuario")
+        users = self._admin_snapshot(offset, search)["users"]
+        
+        if users and isinstance(users, list):
+            # Extraer solo los correos electrónicos para el selectbox
+            email_list = [user.get('email', '') for user in users if user.get('email')]
             
-            if users and isinstance(users, list):
-                # Extraer solo los correos electrónicos para el selectbox
-                email_list = [user.get('email', '') for user in users if user.get('email')]
+            if email_list:
+                email_to_remove = st.selectbox(
+                    "Seleccionar email a remover",
+                    [""] + email_list,
+                    format_func=lambda x: x if x else "Selecciona un email"
+                )
                 
-                if email_list:
-                    email_to_remove = st.selectbox(
-                        "Seleccionar email a remover",
-                        [""] + email_list,
-                        format_func=lambda x: x if x else "Selecciona un email"
-                    )
-                    
-                    if email_to_remove and st.button("🗑️ Remover Usuario Seleccionado", type="primary", use_container_width=True):
-                        if self.supabase.remove_email_from_whitelist(email_to_remove):
-                            st.success(f"✅ {email_to_remove} removido exitosamente")
-                            st.rerun()
-                        else:
-                            st.error(f"❌ Error al remover {email_to_remove}")
-                else:
-                    st.info("ℹ️ No hay usuarios para remover")
+                if email_to_remove and st.button("🗑️ Remover Usuario Seleccionado", type="primary", use_container_width=True):
+                    if self.supabase.remove_email_from_whitelist(email_to_remove):
+                        st.success(f"✅ {email_to_remove} removido exitosamente")
+                        self._invalidate_whitelist()
+                    else:
+                        st.error(f"❌ Error al remover {email_to_remove}")
             else:
                 st.info("ℹ️ No hay usuarios para remover")
+        else:
+            st.info("ℹ️ No hay usuarios para remover")
+
+    def _admin_snapshot(self, offset: int, search: Optional[str]) -> dict:
+        """Datos del panel de administración para la página y búsqueda actuales."""
+        return _cached_admin_snapshot(
+            self.supabase,
+            offset=offset,
+            limit=ADMIN_PAGE_SIZE,
+            search=search
+        )
+
+    def _invalidate_whitelist(self):
+        """Invalida los datos cacheados de la whitelist sin forzar un rerun."""
+        _cached_admin_snapshot.clear()
 
     def _is_valid_email(self, email: str) -> bool:
         """Valida el formato de un email."""
-        import re
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        return _EMAIL_RE.match(email) is not None
 
     def logout(self):
         """Cierra la sesión del usuario."""
@@ -225,4 +300,6 @@ class AuthManager:
             del st.session_state.authenticated
         if 'user_email' in st.session_state:
             del st.session_state.user_email
+        if 'is_admin' in st.session_state:
+            del st.session_state.is_admin
         st.rerun()
@@ -0,0 +1,106 @@
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+# Instrucciones fijas de cada modo. Van al principio del prompt y no contienen
+# datos del usuario, de modo que el prefijo es idéntico entre peticiones y
+# OpenAI puede reutilizarlo con su caché automática de prompts.
+_PROMPT_HEADER = """Eres un guía turístico experto creando un tour de audio para el lugar indicado en la sección DATOS DEL TOUR.
+Ajusta la extensión del guion a la duración objetivo y da prioridad a los intereses del visitante.
+"""
+
+_SAVAGE_INSTR = _PROMPT_HEADER + """
+Genera un guion de audio con:
+1. Una introducción cruda, grotesca y con un toque morboso.
+2. Puntos de interés narrados con descripciones intensas, sin suavizar lo desagradable.
+3. Historias oscuras o polémicas que generen incomodidad y reflexión.
+4. Una conclusión fuerte, con impacto duradero.
+
+El tono debe ser cercano pero crudo, directo, sin miedo a incomodar.
+"""
+
+_ULTRA_INSTR = _PROMPT_HEADER + """
+Genera un guion de audio extremo que:
+1. Abra con una introducción morbosa, grotesca y provocadora.
+2. Describa puntos de interés con crudeza absoluta, sin filtros ni suavizar nada.
+3. Incluya historias polémicas, crueles o tabú, diseñadas para provocar reacción.
+4. Termine con una conclusión inquietante, polémica o perturbadora.
+
+⚠️ Después de cada bloque narrativo, añade un breve comentario indicando por qué este fragmento podría resultar delicado, incómodo o controvertido para algunos oyentes.
+
+El tono debe ser desafiante, polémico y transgresor, empujando los límites.
+"""
+
+_NORMAL_INSTR = _PROMPT_HEADER + """
+Genera un guion de audio con:
+1. Una introducción cálida y acogedora.
+2. Puntos de interés narrados de forma clara y atractiva.
+3. Historias interesantes, con un tono positivo y ameno.
+4. Una conclusión inspiradora y cercana.
+
+El tono debe ser amigable, conversacional y accesible para cualquier visitante.
+"""
+
+# Datos variables del tour, siempre al final del prompt
+_TOUR_DATA = """
+---
+DATOS DEL TOUR:
+Ubicación: {location}
+Duración objetivo: {duration} minutos
+Intereses del visitante: {interests}
+{info_block}"""
+
+# Plantillas completas por modo, montadas una sola vez al cargar el módulo
+_TEMPLATES = {
+    "savage": _SAVAGE_INSTR + _TOUR_DATA,
+    "ultra_savage": _ULTRA_INSTR + _TOUR_DATA,
+    "normal": _NORMAL_INSTR + _TOUR_DATA
+}
+
+# Mensaje de sistema de cada modo
+SYSTEM_MESSAGES = {
+    "normal": "Eres un guía turístico experto y amigable.",
+    "savage": "Eres un guía turístico que muestra el lado oscuro y crudo de los lugares, sin filtros.",
+    "ultra_savage": "Eres un guía turístico extremadamente polémico que no tiene límites en su narrativa."
+}
+
+class ModeConfig(NamedTuple):
+    """Parámetros de generación de un modo."""
+    system_message: str
+    temperature: float
+    tokens_per_minute: int
+
+# Configuración de cada modo, resuelta una sola vez al importar el módulo.
+# Tokens de salida por minuto de tour: ≈200 palabras por minuto narrado y
+# ≈1,35 tokens por palabra en español. El modo ultra_savage añade comentarios
+# tras cada bloque y necesita más. MAX_OUTPUT_TOKENS mantiene el tope original.
+MODE_CONFIGS = {
+    "normal": ModeConfig(SYSTEM_MESSAGES["normal"], temperature=0.7, tokens_per_minute=270),
+    "savage": ModeConfig(SYSTEM_MESSAGES["savage"], temperature=0.9, tokens_per_minute=270),
+    "ultra_savage": ModeConfig(SYSTEM_MESSAGES["ultra_savage"], temperature=0.9, tokens_per_minute=330),
+}
+MIN_OUTPUT_TOKENS = 400
+MAX_OUTPUT_TOKENS = 2000
+
+def mode_config(mode: str) -> ModeConfig:
+    """Configuración del modo indicado; modo normal por defecto."""
+    return MODE_CONFIGS.get(mode, MODE_CONFIGS["normal"])
+
+def max_output_tokens(mode: str, duration: int) -> int:
+    """Límite de tokens de salida proporcional a la duración del tour."""
+    per_minute = mode_config(mode).tokens_per_minute
+    return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, duration * per_minute))
+
+@lru_cache(maxsize=256)
+def get_prompt_by_mode(mode: str, location: str, interests: Tuple[str, ...], duration: int, info_input: str = "") -> str:
+    """Devuelve el prompt adecuado según el modo seleccionado.
+    
+    Las instrucciones del modo forman un prefijo constante y los datos del
+    tour se añaden al final.
+    """
+    info_block = f"Información adicional sobre el visitante: {info_input}\n" if info_input else ""
+    return _TEMPLATES.get(mode, _TEMPLATES["normal"]).format_map({  # Modo normal por defecto
+        "location": location,
+        "duration": duration,
+        "interests": ", ".join(interests) or "No especificados",
+        "info_block": info_block
+    })
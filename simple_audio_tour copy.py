@@ -1,14 +1,19 @@
 import streamlit as st
-import asyncio
-import json
+import atexit
 import logging
+import hashlib
+import queue
+import re
 import sys
+import tempfile
+import unicodedata
 import os
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from dotenv import load_dotenv
 from openai import OpenAI
-from typing import Dict, List, Optional
-from pydantic import BaseModel
+from typing import Callable, List, Optional, Tuple
 import time
 
 # Cargar variables de entorno
@@ -17,15 +22,23 @@ load_dotenv()
 # Obtener la API key de las variables de entorno
 API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Configuración de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("audio_tour_debug.log"),
+# Configuración de logging.
+# Los registros se encolan y un hilo de fondo los escribe en disco, de modo que
+# la generación del tour no espera a la escritura del archivo de log.
+# Streamlit re-ejecuta el script en cada rerun: el listener se arranca una sola vez.
+if not any(isinstance(h, QueueHandler) for h in logging.getLogger().handlers):
+    _log_queue = queue.Queue()
+    _queue_handler = QueueHandler(_log_queue)
+    _queue_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(_queue_handler)
+    logging.getLogger().setLevel(logging.INFO)
+    _log_listener = QueueListener(
+        _log_queue,
+        RotatingFileHandler("audio_tour_debug.log", maxBytes=5_000_000, backupCount=3),
         logging.StreamHandler(sys.stdout)
-    ]
-)
+    )
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
 logger = logging.getLogger("AudioTour")
 
 # Configuración de la página
@@ -36,6 +49,31 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Número máximo de tours de audio que se conservan en disco
+MAX_AUDIO_FILES = 50
+
+# Caché de audios sintetizados: el mismo texto no se vuelve a enviar al TTS
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+TTS_SPEED = 1.0
+MAX_TTS_CACHE_FILES = 500
+
+# Síntesis de voz en paralelo con la generación del texto
+TTS_MIN_CHUNK_CHARS = 300  # Se envía un fragmento al TTS al superar este tamaño
+TTS_MAX_WORKERS = 4
+# Fin de frase: puntuación seguida de espacio y de un inicio de frase en mayúscula.
+# Sin `$`: un punto al final del texto recibido hasta ahora puede ser parte de
+# un número ("1.200") o de una abreviatura que continúa en el siguiente delta.
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÑÜ¿¡"«])')
+
+# Caracteres no válidos en el nombre del archivo de audio
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+def _slug(text: str) -> str:
+    """Nombre de archivo seguro: sin acentos, en minúsculas y con guiones bajos."""
+    ascii_text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    return _SLUG_RE.sub('_', ascii_text.lower()).strip('_')[:40]
+
 class SimpleTourGuide:
     """Guía de tour simplificada que genera y reproduce audio."""
     
@@ -46,12 +84,14 @@ class SimpleTourGuide:
         self.client = OpenAI(api_key=api_key)
         self.audio_dir = Path("audio_outputs")
         self.audio_dir.mkdir(exist_ok=True)
+        # Directorio propio: audio_outputs/tts_cache pertenece a la app principal
+        # y la poda de esta app no debe borrar sus audios
+        self.tts_cache_dir = self.audio_dir / "tts_chunk_cache"
+        self.tts_cache_dir.mkdir(exist_ok=True)
         logger.info("Cliente de OpenAI inicializado correctamente")
         
-    def generate_tour_text(self, location: str, interests: List[str], duration: int) -> str:
-        """Genera el texto del tour usando GPT-4."""
-        logger.info(f"Generando tour para {location} con intereses: {interests}")
-        
+    def _tour_messages(self, location: str, interests: List[str], duration: int) -> List[dict]:
+        """Construye los mensajes de chat para generar el tour."""
         # Crear el prompt para el modelo
         prompt = f"""
         Eres un guía turístico experto creando un tour de audio para {location}.
@@ -67,52 +107,131 @@ class SimpleTourGuide:
         
         El tono debe ser conversacional y amigable, como si estuvieras guiando personalmente al visitante.
         """
+        return [
+            {"role": "system", "content": "Eres un guía turístico experto y amigable."},
+            {"role": "user", "content": prompt}
+        ]
         
-        try:
-            logger.info("Enviando solicitud a la API de OpenAI...")
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Eres un guía turístico experto y amigable."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            tour_text = response.choices[0].message.content
-            logger.info("Tour generado exitosamente")
-            logger.debug(f"Contenido generado: {tour_text[:200]}...")  # Mostrar solo el inicio
-            
-            return tour_text
+    def _tts_cache_path(self, text: str) -> Path:
+        """Ruta en caché del audio de `text` según modelo, voz y velocidad."""
+        key = hashlib.sha256(f"{TTS_MODEL}|{TTS_VOICE}|{TTS_SPEED}|{text}".encode("utf-8")).hexdigest()
+        return self.tts_cache_dir / f"{key}.mp3"
+
+    def generate_tour_with_audio(self, location: str, interests: List[str], duration: int,
+                                 filename: str, on_text: Optional[Callable[[str], None]] = None) -> Tuple[str, Path]:
+        """
+        Genera el texto del tour en streaming y sintetiza la voz mientras llega.
+        
+        Cada vez que se acumulan frases completas suficientes se envían al TTS en
+        un hilo de fondo, de modo que la síntesis avanza en paralelo con el modelo
+        de texto en lugar de esperar a que termine.
+        
+        Args:
+            location: Ubicación del tour
+            interests: Lista de intereses del usuario
+            duration: Duración del tour en minutos
+            filename: Nombre del archivo mp3 de salida
+            on_text: Función que recibe el texto acumulado a medida que llega
             
-        except Exception as e:
-            logger.error(f"Error al generar el tour: {str(e)}")
-            raise
-    
-    def text_to_speech(self, text: str, filename: str = "tour_audio.mp3") -> Path:
-        """Convierte el texto a voz usando la API de OpenAI."""
-        logger.info("Iniciando conversión de texto a voz...")
+        Returns:
+            Tuple[str, Path]: Texto completo del tour y ruta del audio
+        """
+        logger.info("Generando tour con audio para %s con intereses: %s", location, interests)
         output_path = self.audio_dir / filename
+        tour_text = ""
+        pending = ""
+        futures = []
         
         try:
-            response = self.client.audio.speech.create(
-                model="tts-1",
-                voice="nova",
-                input=text,
-                response_format="mp3",
-                speed=1.0
-            )
+            with ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as pool:
+                stream = self.client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=self._tour_messages(location, interests, duration),
+                    temperature=0.7,
+                    max_tokens=2000,
+                    stream=True
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    tour_text += delta
+                    pending += delta
+                    if on_text and delta:
+                        on_text(tour_text)
+                    
+                    # Enviar al TTS hasta la última frase completa
+                    if len(pending) >= TTS_MIN_CHUNK_CHARS:
+                        cut = max((m.end() for m in _SENTENCE_END_RE.finditer(pending)), default=0)
+                        if cut:
+                            futures.append(pool.submit(self._synthesize_chunk, pending[:cut]))
+                            pending = pending[cut:]
+                
+                if pending.strip():
+                    futures.append(pool.submit(self._synthesize_chunk, pending))
+                parts = [future.result() for future in futures]
             
-            # Guardar el archivo de audio
-            response.stream_to_file(output_path)
-            logger.info(f"Audio guardado en: {output_path}")
+            # Los frames mp3 se pueden concatenar directamente
+            output_path.write_bytes(b"".join(parts))
+            logger.info("Audio guardado en: %s", output_path)
+            self._prune_audio_files()
             
-            return output_path
+            return tour_text, output_path
             
         except Exception as e:
-            logger.error(f"Error en la generación de voz: {str(e)}")
+            logger.error("Error al generar el tour con audio: %s", e)
             raise
+    
+    def _synthesize_chunk(self, text: str) -> bytes:
+        """Sintetiza un fragmento del tour y devuelve los bytes mp3."""
+        cache_path = self._tts_cache_path(text)
+        if cache_path.exists():
+            return cache_path.read_bytes()
+            
+        with self.client.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=TTS_VOICE,
+            input=text,
+            response_format="mp3",
+            speed=TTS_SPEED
+        ) as response:
+            audio = b"".join(response.iter_bytes(chunk_size=65536))
+        # Temporal con nombre único: otra sesión puede estar escribiendo el mismo fragmento
+        tmp = tempfile.NamedTemporaryFile(dir=cache_path.parent, suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                tmp.write(audio)
+            Path(tmp.name).replace(cache_path)
+        except OSError as e:
+            Path(tmp.name).unlink(missing_ok=True)
+            logger.warning("No se pudo guardar %s en la caché: %s", cache_path.name, e)
+        return audio
+
+    def _prune_audio_files(self) -> None:
+        """Conserva solo los tours y audios cacheados más recientes."""
+        self._prune_dir(self.audio_dir, "tour_*.mp3", MAX_AUDIO_FILES)
+        self._prune_dir(self.tts_cache_dir, "*.mp3", MAX_TTS_CACHE_FILES)
+        
+    @staticmethod
+    def _prune_dir(directory: Path, pattern: str, keep: int) -> None:
+        """Elimina de `directory` los archivos más antiguos por encima de `keep`."""
+        files = []
+        for path in directory.glob(pattern):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue  # Otra sesión lo borró mientras tanto
+        files.sort(reverse=True)
+        for _, old_file in files[keep:]:
+            try:
+                old_file.unlink()
+            except OSError as e:
+                logger.warning("No se pudo eliminar %s: %s", old_file, e)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _read_audio_bytes(path: str, mtime: float) -> bytes:
+    """Lee el mp3 una sola vez; `mtime` invalida la caché si el archivo cambia."""
+    return Path(path).read_bytes()
 
 def main():
     """Función principal de la aplicación."""
@@ -199,12 +318,12 @@ def main():
             st.audio(str(st.session_state.audio_file))
             
             # Botón de descarga
-            with open(st.session_state.audio_file, "rb") as f:
-                audio_bytes = f.read()
-                
             st.download_button(
                 label="💾 Descargar Audio",
-                data=audio_bytes,
+                data=_read_audio_bytes(
+                    str(st.session_state.audio_file),
+                    st.session_state.audio_file.stat().st_mtime
+                ),
                 file_name=st.session_state.audio_file.name,
                 mime="audio/mp3",
                 use_container_width=True
@@ -214,21 +333,19 @@ def main():
     if st.session_state.get('is_generating', False):
         try:
             with st.spinner("🚀 Generando tu tour personalizado..."):
-                # Paso 1: Generar el texto del tour
+                # El texto se muestra a medida que llega y la voz se sintetiza en paralelo
                 start_time = time.time()
-                tour_text = st.session_state.guide.generate_tour_text(location, interests, duration)
+                text_placeholder = st.empty()
+                tour_text, audio_file = st.session_state.guide.generate_tour_with_audio(
+                    location,
+                    interests,
+                    duration,
+                    f"tour_{_slug(location)}_{int(time.time())}.mp3",
+                    on_text=text_placeholder.markdown
+                )
                 st.session_state.tour_text = tour_text
-                st.success(f"✅ Tour generado en {time.time() - start_time:.1f} segundos")
-                
-                # Paso 2: Convertir a voz
-                with st.spinner("🔊 Convirtiendo a voz..."):
-                    start_time = time.time()
-                    audio_file = st.session_state.guide.text_to_speech(
-                        tour_text,
-                        f"tour_{location.lower().replace(' ', '_')}_{int(time.time())}.mp3"
-                    )
-                    st.session_state.audio_file = audio_file
-                    st.success(f"✅ Audio generado en {time.time() - start_time:.1f} segundos")
+                st.session_state.audio_file = audio_file
+                st.success(f"✅ Tour y audio generados en {time.time() - start_time:.1f} segundos")
             
             # Finalizar el estado de generación
             st.session_state.is_generating = False
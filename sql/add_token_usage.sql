@@ -0,0 +1,22 @@
+-- Suma tokens al contador del usuario en una sola sentencia atómica.
+-- Sustituye a la lectura + escritura desde el cliente (dos viajes y una
+-- condición de carrera entre sesiones). Los administradores no consumen tokens.
+-- Acepta ajustes negativos (devolución de reservas), así que solo la puede
+-- ejecutar el rol de servicio: con la clave anónima cualquiera podría poner a
+-- cero su contador o inflar el de otro usuario.
+create or replace function add_token_usage(p_email text, p_tokens int)
+returns int
+language sql
+security definer
+set search_path = public
+as $$
+    update whitelist_users
+       set tokens_used = coalesce(tokens_used, 0) + p_tokens,
+           updated_at = now()
+     where email = p_email
+       and coalesce(role, 'user') <> 'admin'
+    returning tokens_used;
+$$;
+
+revoke execute on function add_token_usage(text, int) from public, anon, authenticated;
+grant execute on function add_token_usage(text, int) to service_role;
@@ -0,0 +1,38 @@
+-- Datos del panel de administración en una sola llamada RPC: la página de la
+-- lista blanca (con búsqueda opcional) y las solicitudes pendientes.
+-- Sustituye a dos consultas PostgREST independientes desde el cliente.
+-- Devuelve toda la lista blanca: solo la puede ejecutar el rol de servicio
+-- (la app en el servidor, con SUPABASE_SERVICE_ROLE_KEY), nunca la clave anónima.
+create or replace function admin_dashboard_snapshot(
+    p_offset int default 0,
+    p_limit int default null,
+    p_search text default null
+)
+returns jsonb
+language sql
+stable
+security invoker
+set search_path = public
+as $$
+    select jsonb_build_object(
+        'users', coalesce((
+            select jsonb_agg(to_jsonb(u))
+              from (select email, role, is_active, created_at
+                      from whitelist_users
+                     where p_search is null or email ilike '%' || p_search || '%'
+                     order by created_at desc
+                    offset p_offset
+                     limit p_limit) u
+        ), '[]'::jsonb),
+        'pending', coalesce((
+            select jsonb_agg(to_jsonb(p))
+              from (select email, created_at, coalesce(role, 'user') as role
+                      from whitelist_users
+                     where not is_active
+                     order by created_at desc) p
+        ), '[]'::jsonb)
+    );
+$$;
+
+revoke execute on function admin_dashboard_snapshot(int, int, text) from public, anon, authenticated;
+grant execute on function admin_dashboard_snapshot(int, int, text) to service_role;
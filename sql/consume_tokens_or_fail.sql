@@ -0,0 +1,53 @@
+-- Comprueba el límite y reserva los tokens en una sola transacción.
+-- El bloqueo de la fila evita que dos sesiones del mismo usuario pasen la
+-- comprobación a la vez y superen juntas el límite.
+-- Solo la ejecuta el rol de servicio y solo reserva cantidades positivas: las
+-- devoluciones van por add_token_usage.
+create or replace function consume_tokens_or_fail(p_email text, p_tokens int)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    r whitelist_users%rowtype;
+    v_used int;
+    v_limit int;
+begin
+    if p_tokens is null or p_tokens <= 0 then
+        return jsonb_build_object('ok', false, 'reason', 'Cantidad de tokens no válida');
+    end if;
+
+    select * into r from whitelist_users where email = p_email for update;
+
+    if not found then
+        return jsonb_build_object('ok', false, 'reason', 'Usuario no encontrado');
+    end if;
+
+    if coalesce(r.role, 'user') = 'admin' then
+        return jsonb_build_object('ok', true, 'is_admin', true);
+    end if;
+
+    v_used := coalesce(r.tokens_used, 0);
+    v_limit := coalesce(nullif(r.token_limit, 0), 10000);  -- Límite predeterminado: 10,000 tokens
+
+    if v_used + p_tokens > v_limit then
+        return jsonb_build_object(
+            'ok', false,
+            'reason', 'Límite de tokens excedido',
+            'tokens_used', v_used,
+            'token_limit', v_limit
+        );
+    end if;
+
+    update whitelist_users
+       set tokens_used = v_used + p_tokens,
+           updated_at = now()
+     where email = p_email;
+
+    return jsonb_build_object('ok', true, 'tokens_used', v_used + p_tokens, 'token_limit', v_limit);
+end;
+$$;
+
+revoke execute on function consume_tokens_or_fail(text, int) from public, anon, authenticated;
+grant execute on function consume_tokens_or_fail(text, int) to service_role;
@@ -0,0 +1,51 @@
+-- Verifica el acceso de un correo y, si no existe, crea la solicitud pendiente.
+-- Una sola llamada RPC sustituye a la consulta + inserción desde el cliente.
+
+-- `on conflict (email)` necesita una restricción única sobre la columna email
+-- (el índice sobre lower(email) no sirve). Se crea si la tabla aún no la tiene.
+do $$
+begin
+    if not exists (
+        select 1
+          from pg_constraint c
+          join pg_attribute a on a.attrelid = c.conrelid and a.attnum = any (c.conkey)
+         where c.conrelid = 'whitelist_users'::regclass
+           and c.contype in ('u', 'p')
+           and array_length(c.conkey, 1) = 1
+           and a.attname = 'email'
+    ) then
+        alter table whitelist_users add constraint whitelist_users_email_key unique (email);
+    end if;
+end;
+$$;
+
+create or replace function login_or_request(p_email text)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    r whitelist_users%rowtype;
+begin
+    p_email := lower(trim(p_email));
+
+    insert into whitelist_users (email, role, is_active, tokens_used, token_limit, created_at, updated_at)
+    values (p_email, 'user', false, 0, 10000, now(), now())
+    on conflict (email) do nothing
+    returning * into r;
+
+    if found then
+        return jsonb_build_object('exists', false, 'is_active', false, 'role', 'user', 'created', true);
+    end if;
+
+    select * into r from whitelist_users where email = p_email;
+
+    return jsonb_build_object(
+        'exists', true,
+        'is_active', coalesce(r.is_active, false),
+        'role', coalesce(r.role, 'user'),
+        'created', false
+    );
+end;
+$$;
@@ -0,0 +1,28 @@
+-- Bucket privado para los audios TTS, con nombre derivado del hash del
+-- contenido (modelo, voz, texto). Permite reutilizar el mismo audio entre
+-- instancias de la app en lugar de volver a sintetizarlo.
+-- Solo accede la app en el servidor con el rol de servicio: con la clave
+-- anónima se podría sustituir un mp3 cacheado y servirlo a todos los usuarios
+-- que pidan el mismo tour. Se puede ejecutar varias veces.
+insert into storage.buckets (id, name, public)
+values ('tts-cache', 'tts-cache', false)
+on conflict (id) do nothing;
+
+drop policy if exists "tts-cache lectura" on storage.objects;
+create policy "tts-cache lectura"
+    on storage.objects for select
+    to service_role
+    using (bucket_id = 'tts-cache');
+
+drop policy if exists "tts-cache escritura" on storage.objects;
+create policy "tts-cache escritura"
+    on storage.objects for insert
+    to service_role
+    with check (bucket_id = 'tts-cache');
+
+drop policy if exists "tts-cache actualización" on storage.objects;
+create policy "tts-cache actualización"
+    on storage.objects for update
+    to service_role
+    using (bucket_id = 'tts-cache')
+    with check (bucket_id = 'tts-cache');
@@ -0,0 +1,20 @@
+-- Índices de cobertura para whitelist_users.
+-- Usan `concurrently` para no bloquear la tabla, así que no pueden ir dentro
+-- de una transacción: ejecutar este archivo aparte, sentencia a sentencia,
+-- y no junto con otras migraciones.
+
+-- Las consultas por `email = ...` leen rol, estado y contadores
+-- (check_email_in_whitelist, check_token_usage): con las columnas incluidas se
+-- resuelven con un index-only scan. La unicidad ya la da la restricción
+-- whitelist_users_email_key (login_or_request.sql), por eso este no es único.
+create index concurrently if not exists whitelist_users_email_covering_idx
+    on whitelist_users (email) include (role, is_active, tokens_used, token_limit);
+
+-- Listado del panel de administración, ordenado por fecha de alta
+create index concurrently if not exists whitelist_users_created_at_idx
+    on whitelist_users (created_at desc) include (email, role, is_active);
+
+-- Solicitudes pendientes: índice parcial, pequeño mientras haya pocas pendientes
+create index concurrently if not exists whitelist_users_pending_idx
+    on whitelist_users (created_at desc) include (email, role)
+    where not is_active;
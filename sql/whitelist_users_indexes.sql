@@ -0,0 +1,6 @@
+-- Los correos se guardan normalizados (trim + minúsculas) desde la aplicación.
+-- El índice garantiza que no existan variantes con distinto uso de mayúsculas.
+-- Las búsquedas filtran por `email = ...` y usan la restricción única sobre
+-- email (login_or_request.sql) y los índices de whitelist_users_covering_indexes.sql.
+create unique index if not exists whitelist_users_email_lower
+    on whitelist_users (lower(email));
@@ -2,11 +2,29 @@ import os
 import streamlit as st
 from supabase import create_client, Client
 import logging
-from typing import List, Optional, Dict, Any, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Filas por página al recorrer tablas completas (PostgREST corta en max-rows)
+_PAGE_SIZE = 1000
+
+# Bucket de Supabase Storage donde se comparten los audios generados
+TTS_BUCKET = "tts-cache"
+
+
+@st.cache_resource(show_spinner=False)
+def _shared_client(url: str, key: str) -> Client:
+    """Cliente de Supabase único por proceso.
+    
+    Todas las instancias de SupabaseManager reutilizan sus sesiones HTTP, de
+    modo que las conexiones keep-alive se comparten y no se repite el
+    handshake TLS por cada manager creado.
+    """
+    return create_client(url, key)
+
+
 class SupabaseManager:
     """Clase para gestionar todas las interacciones con la base de datos Supabase."""
 
@@ -15,9 +33,19 @@ class SupabaseManager:
         self.client = self._init_supabase()
 
     def _init_supabase(self) -> Optional[Client]:
-        """Inicializa y retorna el cliente de Supabase."""
+        """Inicializa y retorna el cliente de Supabase.
+        
+        La app se ejecuta en el servidor y usa la clave de servicio: las
+        funciones RPC de administración y de tokens no se pueden ejecutar con
+        la clave anónima, que es pública.
+        """
         url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_ANON_KEY")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not key:
+            key = os.getenv("SUPABASE_ANON_KEY")
+            if key:
+                logger.warning("SUPABASE_SERVICE_ROLE_KEY no configurada; con la clave anónima "
+                               "fallarán las funciones restringidas al rol de servicio.")
 
         if not url or not key:
             st.error("❌ URL o clave de Supabase no configurada. Contacta al administrador.")
@@ -26,7 +54,7 @@ class SupabaseManager:
             return None
         
         try:
-            return create_client(url, key)
+            return _shared_client(url, key)
         except Exception as e:
             st.error(f"❌ Error al conectar con Supabase: {e}")
             logger.error(f"Error al crear el cliente de Supabase: {e}")
@@ -53,11 +81,11 @@ class SupabaseManager:
             # Verificar en la tabla whitelist_users
             result = self.client.table("whitelist_users") \
                              .select("is_active, role") \
-                             .eq("email", email) \
+                             .eq("email", email.strip().lower()) \
                              .maybe_single() \
                              .execute()
             
-            if not result.data:
+            if not result or not result.data:
                 return {"exists": False, "is_active": False, "role": "user"}
                 
             # El correo existe, devolvemos su estado actual
@@ -71,39 +99,48 @@ class SupabaseManager:
             logger.error(f"Error al verificar whitelist_users: {e}")
             return {"exists": False, "is_active": False, "role": "user"}
             
-    def is_admin(self, email: str) -> bool:
-        """Verifica si el usuario es administrador."""
+    def login_or_request(self, email: str) -> Dict[str, Any]:
+        """
+        Verifica el acceso de un correo y crea la solicitud si no existe,
+        todo en una sola llamada a la función `login_or_request` de Postgres.
+        
+        Returns:
+            Dict con las claves:
+            - exists: bool - Si el correo ya estaba en la tabla
+            - is_active: bool - Si la cuenta está activa
+            - role: str - Rol del usuario
+            - created: bool - Si se acaba de crear una solicitud pendiente
+        """
+        default = {"exists": False, "is_active": False, "role": "user", "created": False}
         if not self.client or not email:
-            return False
+            return default
             
         try:
-            result = self.client.table("whitelist_users") \
-                             .select("role") \
-                             .eq("email", email) \
-                             .maybe_single() \
-                             .execute()
-            
-            return result.data and result.data.get('role') == 'admin'
+            result = self.client.rpc("login_or_request", {"p_email": email}).execute()
+            return {**default, **(result.data or {})}
             
         except Exception as e:
-            logger.error(f"Error al verificar rol de administrador: {e}")
-            return False
-            
-    def get_all_whitelist_emails(self) -> List[Dict[str, Any]]:
-        """Obtiene todos los correos electrónicos de la lista blanca."""
-        if not self.client:
-            return []
-            
-        try:
-            result = self.client.table("whitelist_users") \
-                             .select("email, role, is_active, created_at") \
-                             .order("created_at", desc=True) \
-                             .execute()
-            return result.data or []
+            logger.error(f"Error en login_or_request: {e}")
+            return default
             
-        except Exception as e:
-            logger.error(f"Error al obtener la lista blanca: {e}")
-            return []
+    def _iter_pages(self, build_query: Callable[[], Any], page_size: int = _PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        Recorre una consulta por páginas con `range()`.
+        
+        Cada página se pide solo cuando se ha consumido la anterior, y las tablas
+        grandes no quedan truncadas por el límite de filas de PostgREST.
+        
+        Args:
+            build_query: Función que devuelve la consulta ya ordenada, sin ejecutar
+            page_size: Filas por petición
+        """
+        offset = 0
+        while True:
+            rows = build_query().range(offset, offset + page_size - 1).execute().data or []
+            yield from rows
+            if len(rows) < page_size:
+                return
+            offset += page_size
             
     def request_access(self, email: str) -> Dict[str, Any]:
         """
@@ -127,43 +164,31 @@ class SupabaseManager:
             return error_response
             
         try:
-            # Verificar el estado actual del correo
-            current_status = self.check_email_in_whitelist(email)
-            
-            # Si el correo ya existe
-            if current_status["exists"]:
-                if current_status["is_active"]:
-                    return {
-                        "success": True,
-                        "message": "Esta cuenta ya está activa",
-                        "status": "active"
-                    }
-                else:
-                    return {
-                        "success": True,
-                        "message": "Ya tienes una solicitud pendiente de aprobación. Te notificaremos cuando sea revisada.",
-                        "status": "pending"
-                    }
-            
-            # Si el correo no existe, crear nueva solicitud
-            result = self.client.table("whitelist_users").insert({
-                "email": email,
-                "role": "user",
-                "is_active": False,
-                "created_at": datetime.now().isoformat(),
-                "tokens_used": 0,
-                "token_limit": 10000,  # Límite por defecto
-                "updated_at": datetime.now().isoformat()
-            }).execute()
+            # Consulta e inserción en una sola llamada; sin carrera entre ambas
+            result = self.client.rpc("login_or_request", {"p_email": email}).execute()
+            status = result.data or {}
             
-            # Verificar si la inserción fue exitosa
-            if not result.data:
+            if status.get("created"):
+                return {
+                    "success": True,
+                    "message": "✅ Solicitud de acceso creada correctamente. Un administrador la revisará pronto.",
+                    "status": "pending"
+                }
+                
+            if not status.get("exists"):
                 error_response["message"] = "No se pudo crear la solicitud. Inténtalo de nuevo."
                 return error_response
-            
+                
+            if status.get("is_active"):
+                return {
+                    "success": True,
+                    "message": "Esta cuenta ya está activa",
+                    "status": "active"
+                }
+                
             return {
                 "success": True,
-                "message": "✅ Solicitud de acceso creada correctamente. Un administrador la revisará pronto.",
+                "message": "Ya tienes una solicitud pendiente de aprobación. Te notificaremos cuando sea revisada.",
                 "status": "pending"
             }
             
@@ -190,47 +215,65 @@ class SupabaseManager:
             }
             
         try:
-            # Verificar si el usuario existe
-            current_status = self.check_email_in_whitelist(email)
-            
-            if not current_status["exists"]:
-                return {
-                    "success": False,
-                    "message": "El usuario no existe",
-                    "user": None
-                }
-                
-            if current_status["is_active"]:
-                return {
-                    "success": True,
-                    "message": "El usuario ya está activo",
-                    "user": {"email": email, "is_active": True, "role": current_status["role"]}
-                }
-            
-            # Actualizar el estado a activo
+            # Activar solo si está pendiente; el UPDATE devuelve la fila
+            # modificada, así que en el caso habitual no hace falta otra lectura
             result = self.client.table("whitelist_users") \
                              .update({
                                  "is_active": True,
                                  "updated_at": datetime.now().isoformat()
                              }) \
                              .eq("email", email) \
+                             .eq("is_active", False) \
                              .execute()
             
-            if not result.data:
+            if result.data:
+                return {
+                    "success": True,
+                    "message": "Usuario aprobado exitosamente",
+                    "user": result.data[0]
+                }
+                
+            # Ninguna fila pendiente: distinguir entre usuario inexistente y ya activo
+            current_status = self.check_email_in_whitelist(email)
+            
+            if not current_status["exists"]:
                 return {
                     "success": False,
-                    "message": "No se pudo actualizar el usuario",
+                    "message": "El usuario no existe",
                     "user": None
                 }
                 
             return {
                 "success": True,
-                "message": "Usuario aprobado exitosamente",
-                "user": result.data[0] if result.data else None
+                "message": "El usuario ya está activo",
+                "user": {"email": email, "is_active": True, "role": current_status["role"]}
             }
             
         except Exception as e:
             logger.error(f"Error al aprobar usuario {email}: {e}")
+            return {
+                "success": False,
+                "message": "No se pudo actualizar el usuario",
+                "user": None
+            }
+            
+    def approve_users_bulk(self, emails: List[str]) -> bool:
+        """Aprueba varias solicitudes de acceso con una sola actualización."""
+        if not self.client or not emails:
+            return False
+            
+        try:
+            self.client.table("whitelist_users") \
+                     .update({
+                         "is_active": True,
+                         "updated_at": datetime.now().isoformat()
+                     }) \
+                     .in_("email", emails) \
+                     .execute()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error al aprobar usuarios en bloque: {e}")
             return False
             
     def add_email_to_whitelist(self, email: str, role: str = 'user') -> bool:
@@ -239,12 +282,14 @@ class SupabaseManager:
             return False
             
         try:
+            # Una sola sentencia INSERT ... ON CONFLICT (email): si el correo ya
+            # existe se activa con el rol indicado
             self.client.table("whitelist_users").upsert({
                 "email": email,
                 "role": role,
                 "is_active": True,
                 "created_at": "now()"
-            }).execute()
+            }, on_conflict="email").execute()
             return True
             
         except Exception as e:
@@ -267,23 +312,26 @@ class SupabaseManager:
             logger.error(f"Error al eliminar email de la lista blanca: {e}")
             return False
             
-    def add_to_whitelist(self, email: str, is_admin: bool = False) -> bool:
-        """Agrega un correo a la lista blanca."""
-        if not self.client:
+    def remove_emails_bulk(self, emails: List[str]) -> bool:
+        """Elimina varios emails de la lista blanca con un solo borrado."""
+        if not self.client or not emails:
             return False
             
         try:
-            self.client.table("whitelist").upsert({
-                "email": email,
-                "is_approved": True,
-                "is_admin": is_admin,
-                "added_at": datetime.utcnow().isoformat()
-            }).execute()
+            self.client.table("whitelist_users") \
+                     .delete() \
+                     .in_("email", emails) \
+                     .execute()
             return True
+            
         except Exception as e:
-            logger.error(f"Error al agregar a lista blanca: {e}")
+            logger.error(f"Error al eliminar emails de la lista blanca: {e}")
             return False
             
+    def add_to_whitelist(self, email: str, is_admin: bool = False) -> bool:
+        """Agrega un correo a la lista blanca (alias de add_email_to_whitelist)."""
+        return self.add_email_to_whitelist(email, "admin" if is_admin else "user")
+            
     def get_pending_approvals(self) -> List[Dict[str, Any]]:
         """
         Obtiene las solicitudes pendientes de aprobación.
@@ -316,10 +364,41 @@ class SupabaseManager:
             logger.error(f"Error al obtener aprobaciones pendientes: {e}")
             return []
             
+    def get_admin_snapshot(self, offset: int = 0, limit: Optional[int] = None,
+                           search: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Obtiene los datos del panel de administración en una sola llamada a la
+        función `admin_dashboard_snapshot` de Postgres.
+        
+        Returns:
+            Dict con las claves:
+            - users: List[Dict] - Página de la lista blanca
+            - pending: List[Dict] - Solicitudes pendientes de aprobación
+        """
+        snapshot = {"users": [], "pending": []}
+        if not self.client:
+            return snapshot
+            
+        try:
+            result = self.client.rpc("admin_dashboard_snapshot", {
+                "p_offset": offset,
+                "p_limit": limit,
+                "p_search": search or None
+            }).execute()
+            return {**snapshot, **(result.data or {})}
+            
+        except Exception as e:
+            logger.error(f"Error al obtener los datos del panel de administración: {e}")
+            return snapshot
+            
     def reject_user(self, email: str) -> bool:
         """Rechaza una solicitud de acceso."""
         return self.remove_email_from_whitelist(email)
             
+    def reject_users_bulk(self, emails: List[str]) -> bool:
+        """Rechaza varias solicitudes de acceso con un solo borrado."""
+        return self.remove_emails_bulk(emails)
+            
     def update_user_role(self, email: str, role: str) -> bool:
         """Actualiza el rol de un usuario."""
         if not self.client or not email or not role:
@@ -336,19 +415,8 @@ class SupabaseManager:
             return False
             
     def remove_from_whitelist(self, email: str) -> bool:
-        """Elimina un correo de la lista blanca."""
-        if not self.client:
-            return False
-            
-        try:
-            self.client.table("whitelist") \
-                     .delete() \
-                     .eq("email", email) \
-                     .execute()
-            return True
-        except Exception as e:
-            logger.error(f"Error al eliminar de lista blanca: {e}")
-            return False
+        """Elimina un correo de la lista blanca (alias de remove_email_from_whitelist)."""
+        return self.remove_email_from_whitelist(email)
 
     # ==========================
     # Token Management
@@ -359,19 +427,9 @@ class SupabaseManager:
             return {"can_proceed": False, "reason": "Error de autenticación"}
             
         try:
-            # Verificar si el usuario es administrador
-            if self.is_admin(email):
-                return {
-                    "can_proceed": True,
-                    "tokens_used": 0,
-                    "tokens_limit": float('inf'),
-                    "is_admin": True,
-                    "message": "Admin sin restricciones"
-                }
-                
-            # Obtener información de tokens del usuario
+            # Rol y contadores en una sola consulta
             result = self.client.table("whitelist_users") \
-                             .select("tokens_used, token_limit") \
+                             .select("role, tokens_used, token_limit") \
                              .eq("email", email) \
                              .maybe_single() \
                              .execute()
@@ -379,6 +437,15 @@ class SupabaseManager:
             if not result.data:
                 return {"can_proceed": False, "reason": "Usuario no encontrado"}
                 
+            if result.data.get('role') == 'admin':
+                return {
+                    "can_proceed": True,
+                    "tokens_used": 0,
+                    "tokens_limit": float('inf'),
+                    "is_admin": True,
+                    "message": "Admin sin restricciones"
+                }
+                
             tokens_used = result.data.get('tokens_used', 0) or 0
             token_limit = result.data.get('token_limit', 10000) or 10000  # Límite predeterminado: 10,000 tokens
             
@@ -408,35 +475,52 @@ class SupabaseManager:
                 "message": "Error al verificar tokens, acceso permitido"
             }
 
-    def update_token_usage(self, email: str, tokens_used: int) -> bool:
-        """Actualiza el contador de tokens usados por un usuario."""
-        # No actualizar tokens para administradores
-        if self.is_admin(email):
-            return True
-            
+    def consume_tokens(self, email: str, tokens: int) -> Dict[str, Any]:
+        """
+        Comprueba el límite y reserva `tokens` de forma atómica.
+        
+        Usa la función `consume_tokens_or_fail` de Postgres: comprobación e
+        incremento van en una sola llamada, sin la carrera entre leer el
+        contador y escribirlo.
+        
+        Returns:
+            Dict con `can_proceed`, `reserved` (si los tokens se sumaron de verdad
+            al contador) y, si se rechaza, `reason`
+        """
         if not self.client or not email:
-            return False
+            return {"can_proceed": False, "reserved": False, "reason": "Error de autenticación"}
             
         try:
-            # Obtener el conteo actual de tokens
-            result = self.client.table("whitelist_users") \
-                             .select("tokens_used") \
-                             .eq("email", email) \
-                             .maybe_single() \
-                             .execute()
+            result = self.client.rpc("consume_tokens_or_fail", {"p_email": email, "p_tokens": tokens}).execute()
+            data = result.data or {}
+            return {
+                "can_proceed": bool(data.get("ok")),
+                # Los administradores pasan sin que se les sume nada
+                "reserved": bool(data.get("ok")) and not data.get("is_admin"),
+                "reason": data.get("reason", "Límite de tokens excedido"),
+                "tokens_used": data.get("tokens_used", 0),
+                "tokens_limit": data.get("token_limit", float('inf')),
+                "is_admin": bool(data.get("is_admin"))
+            }
             
-            if not result.data:
-                return False
-                
-            current_tokens = result.data.get('tokens_used', 0) or 0
-            new_tokens = current_tokens + tokens_used
+        except Exception as e:
+            logger.error(f"Error al reservar tokens: {e}")
+            # En caso de error, permitir el acceso sin reserva; el consumo real
+            # se suma completo al terminar
+            return {"can_proceed": True, "reserved": False}
+
+    def update_token_usage(self, email: str, tokens_used: int) -> bool:
+        """Actualiza el contador de tokens usados por un usuario.
+        
+        El incremento se hace en Postgres con la función `add_token_usage`, en
+        un solo viaje y sin carreras entre sesiones. Los administradores se
+        excluyen en la propia función.
+        """
+        if not self.client or not email:
+            return False
             
-            # Actualizar el contador de tokens
-            self.client.table("whitelist_users") \
-                     .update({"tokens_used": new_tokens}) \
-                     .eq("email", email) \
-                     .execute()
-                     
+        try:
+            self.client.rpc("add_token_usage", {"p_email": email, "p_tokens": tokens_used}).execute()
             return True
             
         except Exception as e:
@@ -450,15 +534,22 @@ class SupabaseManager:
             return []
         
         try:
-            result = self.client.table("user_token_usage") \
-                             .select("*") \
-                             .order("user_email") \
-                             .execute()
-            return result.data
+            return list(self.iter_token_usage())
         except Exception as e:
             logger.error(f"Error al obtener el uso de tokens: {e}")
             return []
 
+    def iter_token_usage(self, page_size: int = _PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """Recorre el uso de tokens de todos los usuarios por páginas."""
+        if not self.client:
+            return iter(())
+        return self._iter_pages(
+            lambda: self.client.table("user_token_usage") \
+                               .select("user_email, tokens_used, tokens_limit") \
+                               .order("user_email"),
+            page_size
+        )
+
     def update_token_limit(self, email: str, new_limit: int) -> bool:
         """Actualiza el límite de tokens para un usuario."""
         if not self.client:
@@ -489,4 +580,64 @@ class SupabaseManager:
             return True
         except Exception as e:
             logger.error(f"Error al reiniciar el contador de tokens: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def bulk_update_token_limits(self, limits: Dict[str, int]) -> bool:
+        """Actualiza los límites de tokens de varios usuarios con un solo upsert."""
+        if not self.client or not limits:
+            return False
+            
+        try:
+            self.client.table("user_token_usage") \
+                     .upsert([
+                         {"user_email": email, "tokens_limit": limit}
+                         for email, limit in limits.items()
+                     ]) \
+                     .execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error al actualizar límites de tokens en bloque: {e}")
+            return False
+
+    def reset_token_usage_bulk(self, emails: List[str]) -> bool:
+        """Reinicia el contador de tokens de varios usuarios con una sola actualización."""
+        if not self.client or not emails:
+            return False
+            
+        try:
+            self.client.table("user_token_usage") \
+                     .update({"tokens_used": 0}) \
+                     .in_("user_email", emails) \
+                     .execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error al reiniciar contadores de tokens en bloque: {e}")
+            return False
+    # ==========================
+    # Audio Storage Methods
+    # ==========================
+
+    def download_audio(self, name: str) -> Optional[bytes]:
+        """Descarga un audio del bucket de caché; None si no existe o falla."""
+        if not self.client:
+            return None
+            
+        try:
+            return self.client.storage.from_(TTS_BUCKET).download(name)
+        except Exception as e:
+            logger.debug(f"Audio {name} no disponible en Storage: {e}")
+            return None
+
+    def upload_audio(self, name: str, data: bytes) -> bool:
+        """Sube un audio mp3 al bucket de caché compartido entre instancias."""
+        if not self.client:
+            return False
+            
+        try:
+            self.client.storage.from_(TTS_BUCKET).upload(
+                name, data, {"content-type": "audio/mpeg", "upsert": "true"}
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error al subir el audio {name} a Storage: {e}")
+            return False
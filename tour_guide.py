@@ -0,0 +1,653 @@
+import streamlit as st
+import atexit
+import hashlib
+import httpx
+import json
+import logging
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from typing import Callable, List, Optional
+from auth_manager import cached_token_status
+from prompts import get_prompt_by_mode, max_output_tokens, mode_config
+from supabase_manager import SupabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Modelos de texto en orden de preferencia: si uno falla se prueba el siguiente
+TEXT_MODELS = ("gpt-4o", "gpt-4o-mini")
+
+# Errores transitorios tras los que tiene sentido probar otro modelo. El SDK ya
+# reintenta cada uno con backoff exponencial, jitter y respetando Retry-After.
+_RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# Modelo de voz y caché en disco de los audios generados
+TTS_MODEL = "tts-1"
+AUDIO_DIR = Path("audio_outputs")
+TTS_CACHE_TTL = 7 * 24 * 3600  # Segundos que se conserva un audio cacheado
+TTS_CHUNK_CHARS = 800  # Tamaño aproximado de cada fragmento enviado en paralelo al TTS
+TTS_MAX_WORKERS = 8  # Tope de peticiones TTS simultáneas; el limitador adaptativo decide cuántas se usan
+TTS_INITIAL_CONCURRENCY = 4
+
+# Fin de frase: puntuación final seguida de un inicio de frase en mayúscula,
+# de modo que no se corta en decimales ni tras abreviaturas en minúscula
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÑÜ¿¡"«])')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+# Caché persistente de los textos generados (sobrevive a reinicios de la app)
+TOUR_CACHE_PATH = AUDIO_DIR / "tour_cache.sqlite"
+TOUR_CACHE_TTL = 7 * 24 * 3600  # Segundos que se reutiliza un tour generado
+
+# Segundos que se acumulan los ajustes de tokens antes de escribirlos en Supabase
+USAGE_FLUSH_INTERVAL = 30
+
+def _pack(pieces: List[str], separator: str, max_chars: int) -> List[str]:
+    """Une piezas consecutivas mientras quepan en `max_chars` caracteres."""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def split_into_chunks(text: str, max_chars: int = TTS_CHUNK_CHARS) -> List[str]:
+    """Agrupa el texto en fragmentos de hasta `max_chars` caracteres.
+    
+    Se corta preferentemente entre párrafos, donde la narración ya hace una
+    pausa; solo los párrafos más largos que `max_chars` se dividen por frases.
+    """
+    pieces = []
+    for paragraph in _PARAGRAPH_RE.split(text.strip()):
+        paragraph = paragraph.strip()
+        if len(paragraph) > max_chars:
+            pieces.extend(_pack(_SENTENCE_END_RE.split(paragraph), " ", max_chars))
+        elif paragraph:
+            pieces.append(paragraph)
+    return _pack(pieces, "\n\n", max_chars)
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Tokenizador del modelo principal, o None si tiktoken no está disponible."""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(TEXT_MODELS[0])
+    except Exception as e:
+        logger.warning("No se pudo cargar tiktoken, se estimarán los tokens por longitud: %s", e)
+        return None
+
+@lru_cache(maxsize=256)
+def count_tokens(text: str) -> int:
+    """Número de tokens de `text` para el modelo principal (≈4 caracteres por token sin tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+@st.cache_resource
+def _openai_client(api_key: str) -> OpenAI:
+    """Cliente de OpenAI compartido por todas las sesiones y reruns.
+    
+    Texto y voz usan el mismo pool de conexiones keep-alive, y los reintentos
+    del SDK también, sin pagar un nuevo handshake TLS.
+    """
+    # Conectar debe ser rápido: si falla, el SDK reintenta antes que esperar 60 s
+    timeout = httpx.Timeout(60.0, connect=5.0)
+    return OpenAI(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=3,
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=timeout
+        )
+    )
+
+class _AdaptiveLimiter:
+    """Limitador AIMD de peticiones simultáneas a OpenAI.
+    
+    Suma uno al límite tras una racha de respuestas correctas y lo divide a la
+    mitad ante un 429 o cuando las cabeceras x-ratelimit indican que queda
+    menos del 10% de la cuota de peticiones.
+    """
+    
+    SUCCESS_STREAK = 20
+    
+    def __init__(self, initial: int, maximum: int):
+        self._limit = initial
+        self._maximum = maximum
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+        
+    @contextmanager
+    def slot(self):
+        """Espera un hueco libre y lo ocupa durante el bloque."""
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+                
+    def on_success(self, headers) -> None:
+        """Registra una respuesta correcta y revisa la cuota restante."""
+        try:
+            remaining = int(headers.get("x-ratelimit-remaining-requests"))
+            limit = int(headers.get("x-ratelimit-limit-requests"))
+        except (TypeError, ValueError):
+            remaining = limit = None
+        if limit and remaining < limit * 0.1:
+            self.on_rate_limited()
+            return
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.SUCCESS_STREAK:
+                self._successes = 0
+                self._limit = min(self._maximum, self._limit + 1)
+                self._cond.notify_all()
+                
+    def on_rate_limited(self) -> None:
+        """Reduce el límite a la mitad tras un 429."""
+        with self._cond:
+            self._successes = 0
+            self._limit = max(1, self._limit // 2)
+            logger.warning("Límite de peticiones TTS simultáneas reducido a %s", self._limit)
+
+@st.cache_resource
+def _tts_limiter() -> _AdaptiveLimiter:
+    """Limitador compartido: la cuota de OpenAI es por API key, no por sesión."""
+    return _AdaptiveLimiter(TTS_INITIAL_CONCURRENCY, TTS_MAX_WORKERS)
+
+class _FlightAborted(Exception):
+    """La sesión que hacía la petición se interrumpió (p. ej. por un rerun de Streamlit)."""
+
+class _SingleFlight:
+    """Agrupa llamadas idénticas concurrentes para que solo una llegue a la API."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        
+    def run(self, key, fn):
+        """Ejecuta `fn` o espera el resultado de una llamada en curso con la misma clave.
+        
+        Si la sesión propietaria se interrumpe (un rerun o stop de Streamlit,
+        que no son Exception), las que esperaban vuelven a intentarlo en lugar
+        de recibir la excepción de control de otra sesión.
+        
+        Returns:
+            tuple: (resultado, True si esta llamada hizo la petición real)
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._calls[key] = future
+                    
+            if owner:
+                break
+            try:
+                return future.result(), False
+            except _FlightAborted:
+                continue
+                
+        try:
+            result = fn()
+        except Exception as e:
+            self._release(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self._release(key)
+            future.set_exception(_FlightAborted())
+            raise
+        self._release(key)
+        future.set_result(result)
+        return result, True
+        
+    def _release(self, key) -> None:
+        """Quita la llamada del registro antes de despertar a quienes esperan."""
+        with self._lock:
+            self._calls.pop(key, None)
+
+@st.cache_resource
+def _generation_flights() -> _SingleFlight:
+    """Registro de generaciones en curso compartido por todas las sesiones."""
+    return _SingleFlight()
+
+class _TourCache:
+    """Caché en disco (sqlite) de tours ya generados para entradas idénticas."""
+    
+    def __init__(self, path: Path, ttl: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._path = str(path)
+        self._ttl = ttl
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS tours (key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)")
+            
+    def _connect(self) -> sqlite3.Connection:
+        # Sin transacciones implícitas: las escrituras abren la suya con BEGIN IMMEDIATE
+        return sqlite3.connect(self._path, timeout=5.0, isolation_level=None)
+        
+    @staticmethod
+    def make_key(location: str, interests: List[str], duration: int, mode: str, info_input: str) -> str:
+        """Construye una clave estable a partir de las entradas canonicalizadas del tour."""
+        payload = json.dumps({
+            "loc": location,
+            "int": sorted(interests),
+            "dur": duration,
+            "mode": mode,
+            "info": info_input,
+            "model": TEXT_MODELS[0]
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        
+    def get(self, key: str):
+        """Devuelve el texto cacheado para `key` o None si no existe o ha caducado."""
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT text FROM tours WHERE key = ? AND created >= ?",
+                    (key, time.time() - self._ttl)
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.warning("No se pudo leer la caché de tours: %s", e)
+            return None
+            
+    def set(self, key: str, text: str) -> None:
+        """Guarda el texto generado para `key`."""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO tours (key, text, created) VALUES (?, ?, ?)",
+                    (key, text, time.time())
+                )
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning("No se pudo guardar en la caché de tours: %s", e)
+
+@st.cache_resource
+def _tour_cache() -> _TourCache:
+    """Caché de tours compartida por todas las sesiones."""
+    return _TourCache(TOUR_CACHE_PATH, TOUR_CACHE_TTL)
+
+class _UsageWriter:
+    """Acumula los ajustes de tokens por usuario y los escribe en Supabase en lote.
+    
+    Varias generaciones seguidas del mismo usuario se convierten en una sola
+    llamada a `update_token_usage` cada USAGE_FLUSH_INTERVAL segundos, en un
+    hilo de fondo que no bloquea la interfaz.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        
+    def add(self, supabase: SupabaseManager, email: str, tokens: int) -> None:
+        """Suma `tokens` (puede ser negativo) al ajuste pendiente de `email`."""
+        with self._lock:
+            _, pending = self._pending.get(email, (supabase, 0))
+            self._pending[email] = (supabase, pending + tokens)
+            if self._timer is None:
+                self._timer = threading.Timer(USAGE_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                
+    def flush(self) -> None:
+        """Escribe todos los ajustes pendientes."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+        for email, (supabase, tokens) in pending.items():
+            if tokens:
+                supabase.update_token_usage(email, tokens)
+        if pending:
+            # El contador de la barra lateral se vuelve a leer tras la escritura
+            cached_token_status.clear()
+
+@st.cache_resource
+def _usage_writer() -> _UsageWriter:
+    """Escritor de consumo compartido; vacía lo pendiente al cerrar el proceso."""
+    writer = _UsageWriter()
+    atexit.register(writer.flush)
+    return writer
+
+@st.cache_resource
+def _supabase_executor() -> ThreadPoolExecutor:
+    """Pool de hilos para las llamadas a Supabase que se solapan con otro trabajo."""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def _tts_executor() -> ThreadPoolExecutor:
+    """Pool de hilos para la síntesis de voz compartido por todas las guías."""
+    return ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS)
+
+class SimpleTourGuide:
+    """Guía de tour simplificada que genera y reproduce audio con gestión de tokens."""
+    
+    __slots__ = ("client", "user_email", "supabase", "tts_cache_dir", "_tts_pool")
+    
+    def __init__(self, api_key: str = None, user_email: str = None, supabase: Optional[SupabaseManager] = None):
+        """Inicializa la guía de tour con la API key de OpenAI y el email del usuario.
+        
+        Args:
+            api_key: Clave de API de OpenAI
+            user_email: Email del usuario para seguimiento de tokens (opcional)
+            supabase: Cliente de Supabase a reutilizar (opcional; si falta se crea uno)
+        """
+        if not api_key:
+            raise ValueError("Se requiere una API key de OpenAI")
+            
+        # Usar el cliente compartido de OpenAI
+        self.client = _openai_client(api_key)
+        self.user_email = user_email
+        self.supabase = (supabase or SupabaseManager()) if user_email else None
+        self.tts_cache_dir = AUDIO_DIR / "tts_cache"
+        self.tts_cache_dir.mkdir(parents=True, exist_ok=True)
+        self._prune_tts_cache()
+        self._tts_pool = _tts_executor()
+        
+    def _prune_tts_cache(self) -> None:
+        """Elimina los audios cacheados más antiguos que TTS_CACHE_TTL."""
+        cutoff = time.time() - TTS_CACHE_TTL
+        for path in self.tts_cache_dir.glob("tts_*.mp3"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError as e:
+                logger.warning("No se pudo limpiar %s: %s", path, e)
+        
+    def _reserve_tokens(self, estimated_tokens: int = 0) -> dict:
+        """Verifica si el usuario puede realizar la operación y reserva los tokens estimados."""
+        if not self.user_email or not self.supabase:
+            return {"can_proceed": True, "reserved": False}  # Sin límite si no hay usuario o supabase
+            
+        return self.supabase.consume_tokens(self.user_email, estimated_tokens)
+        
+    def generate_tour_text(self, location: str, interests: List[str], duration: int, mode: str = "normal",
+                           info_input: str = "", on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Genera el texto del tour usando GPT-4 con control de tokens.
+        
+        Args:
+            location: Ubicación del tour
+            interests: Lista de intereses del usuario
+            duration: Duración del tour en horas
+            mode: Modo de generación (normal, experto, etc.)
+            info_input: Información adicional para personalizar el tour
+            on_text: Función que recibe el texto acumulado a medida que llega
+            
+        Returns:
+            str: Texto generado del tour
+            
+        Raises:
+            ValueError: Si se excede el límite de tokens
+        """
+        # Un tour idéntico ya generado se devuelve sin llamar a la API ni gastar tokens.
+        # Primero se busca en la sesión (memoria) y después en la caché en disco.
+        cache_key = _TourCache.make_key(location, interests, duration, mode, info_input)
+        session_cache = st.session_state.setdefault("_tour_cache", {})
+        cached = session_cache.get(cache_key)
+        if cached is None:
+            cached = _tour_cache().get(cache_key)
+        if cached is not None:
+            session_cache[cache_key] = cached
+            return cached
+            
+        config = mode_config(mode)
+        system_message = config.system_message
+        
+        # Se reserva la salida permitida para esta duración más el mensaje de
+        # sistema. La reserva no depende del prompt, así que el viaje a Supabase
+        # se lanza ya y se solapa con la construcción del prompt; los tokens del
+        # prompt entran en el ajuste posterior al consumo real.
+        max_tokens = max_output_tokens(mode, duration)
+        estimated_tokens = count_tokens(system_message) + max_tokens
+        reservation = _supabase_executor().submit(self._reserve_tokens, estimated_tokens)
+        
+        # El prompt y los parámetros se construyen una sola vez para todos los intentos
+        prompt = get_prompt_by_mode(mode, location, tuple(sorted(interests)), duration, info_input)
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ]
+        temperature = config.temperature
+        
+        token_check = reservation.result()
+        if not token_check.get("can_proceed", True):
+            raise ValueError(token_check.get("reason", "Límite de tokens excedido"))
+        # Solo se descuenta del consumo lo que de verdad se sumó al contador
+        reserved_tokens = estimated_tokens if token_check.get("reserved") else 0
+        
+        # Si otra sesión está generando exactamente el mismo tour, se reutiliza su respuesta
+        flight_key = (mode, location, tuple(sorted(interests)), duration, info_input)
+        
+        settled = False
+        try:
+            (tour_text, usage), owner = _generation_flights().run(
+                flight_key, lambda: self._request_completion(messages, temperature, max_tokens, on_text)
+            )
+            
+            # Ajustar la reserva al consumo real. Si otra sesión hizo la petición,
+            # esta no ha gastado tokens y se devuelve lo reservado.
+            used_tokens = 0
+            if owner:
+                # Usar el conteo real de tokens de la respuesta si está disponible
+                used_tokens = usage.total_tokens if usage else len(tour_text)
+            self._record_token_usage(used_tokens - reserved_tokens)
+            settled = True
+            
+            details = getattr(usage, "prompt_tokens_details", None)
+            if details is not None:
+                logger.debug("Tokens del prompt servidos desde la caché de OpenAI: %s", details.cached_tokens)
+            
+            session_cache[cache_key] = tour_text
+            if owner:
+                _tour_cache().set(cache_key, tour_text)
+            return tour_text
+            
+        except Exception as e:
+            logger.error("Error al generar el tour: %s", e)
+            raise
+            
+        finally:
+            # Error o interrupción (también un rerun de Streamlit, que no es una
+            # Exception): se cobran solo los mensajes y se devuelve la reserva
+            if not settled:
+                self._record_token_usage(count_tokens(system_message) + count_tokens(prompt) - reserved_tokens)
+            
+    def _record_token_usage(self, tokens: int) -> None:
+        """Registra el consumo de tokens en Supabase sin bloquear la respuesta.
+        
+        La escritura se agrupa con otras en segundo plano: el texto del tour se
+        devuelve a la interfaz sin esperar el viaje de ida y vuelta a Supabase.
+        """
+        if not tokens or not self.user_email or not self.supabase:
+            return
+        _usage_writer().add(self.supabase, self.user_email, tokens)
+            
+    def _request_completion(self, messages: List[dict], temperature: float, max_tokens: int,
+                            on_text: Optional[Callable[[str], None]] = None):
+        """Pide la respuesta en streaming al primer modelo de TEXT_MODELS que no falle.
+        
+        Returns:
+            tuple: (texto completo, uso de tokens del último fragmento o None)
+        """
+        last_error = None
+        for model in TEXT_MODELS:
+            try:
+                stream = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                text = ""
+                usage = None
+                for chunk in stream:
+                    # El último fragmento no trae choices, solo el uso de tokens
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if delta:
+                        text += delta
+                        if on_text:
+                            on_text(text)
+                return text, usage
+            except _RETRYABLE_ERRORS as e:
+                logger.warning("Fallo al generar con %s: %s", model, e)
+                last_error = e
+        raise last_error
+        
+    def synthesize_audio(self, text: str, voice: str = "alloy",
+                         on_progress: Optional[Callable[[int, int], None]] = None) -> Path:
+        """
+        Convierte texto a voz con OpenAI TTS, reutilizando el audio si ya existe.
+        
+        Los archivos se guardan en disco con un nombre derivado del hash de
+        (modelo, voz, texto), por lo que regenerar el mismo tour no vuelve a
+        llamar a la API. Con Supabase disponible, el mismo nombre se usa en
+        Storage para compartir el audio entre instancias.
+        
+        Args:
+            text: Texto a convertir a voz
+            voice: Voz a utilizar (alloy, echo, fable, onyx, nova, o shimmer)
+            on_progress: Función que recibe (fragmentos terminados, total) desde
+                el hilo que llama, a medida que se completa cada fragmento
+            
+        Returns:
+            Path: Ruta del archivo mp3 generado
+        """
+        key = hashlib.blake2b(f"{TTS_MODEL}|{voice}|{text.strip()}".encode("utf-8"), digest_size=16).hexdigest()
+        audio_path = self.tts_cache_dir / f"tts_{key}.mp3"
+        
+        if audio_path.exists():
+            logger.info("Audio recuperado de la caché: %s", audio_path.name)
+            return audio_path
+            
+        if self.supabase:
+            data = self.supabase.download_audio(audio_path.name)
+            if data:
+                logger.info("Audio recuperado de Storage: %s", audio_path.name)
+                self._write_audio(audio_path, data)
+                return audio_path
+                
+        # Sintetizar los fragmentos en paralelo; cada uno se guarda en memoria
+        chunks = split_into_chunks(text)
+        futures = [self._tts_pool.submit(self._synthesize_chunk, chunk, voice) for chunk in chunks]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if on_progress:
+                    on_progress(done, len(futures))
+        finally:
+            # Si un fragmento falla, no dejar peticiones pendientes en el pool
+            for future in futures:
+                future.cancel()
+                
+        # Los frames mp3 se pueden concatenar directamente
+        data = b"".join(future.result() for future in futures)
+        self._write_audio(audio_path, data)
+        if self.supabase:
+            # Subir en segundo plano; el usuario no espera a Storage
+            self._tts_pool.submit(self.supabase.upload_audio, audio_path.name, data)
+        return audio_path
+        
+    @staticmethod
+    def _write_audio(audio_path: Path, data: bytes) -> None:
+        """Escribe en un archivo temporal y renombra para no dejar audios a medias en la caché.
+        
+        El temporal tiene nombre único: dos sesiones que sintetizan el mismo
+        texto no se pisan y la última en renombrar simplemente gana.
+        """
+        tmp = tempfile.NamedTemporaryFile(dir=audio_path.parent, prefix=f"{audio_path.stem}_",
+                                          suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                tmp.write(data)
+            Path(tmp.name).replace(audio_path)
+        except BaseException:
+            Path(tmp.name).unlink(missing_ok=True)
+            raise
+        
+    def _synthesize_chunk(self, text: str, voice: str) -> bytes:
+        """Sintetiza un fragmento de texto y devuelve los bytes mp3."""
+        limiter = _tts_limiter()
+        with limiter.slot():
+            try:
+                with self.client.audio.speech.with_streaming_response.create(
+                    model=TTS_MODEL,
+                    voice=voice,
+                    input=text
+                ) as response:
+                    audio = b"".join(response.iter_bytes(64 * 1024))
+            except RateLimitError:
+                limiter.on_rate_limited()
+                raise
+        limiter.on_success(response.headers)
+        return audio
+        
+    def generate_and_play_audio(self, text: str, voice: str = "alloy") -> None:
+        """
+        Genera audio a partir de texto usando OpenAI TTS y lo reproduce en la interfaz.
+        
+        Args:
+            text: Texto a convertir a voz
+            voice: Voz a utilizar (alloy, echo, fable, onyx, nova, o shimmer)
+        """
+        if not text.strip():
+            st.warning("No hay texto para convertir a audio.")
+            return
+            
+        with st.spinner("Generando audio..."):
+            try:
+                # La barra avanza con cada fragmento sintetizado en paralelo
+                progress = st.progress(0.0)
+                audio_file = self.synthesize_audio(
+                    text,
+                    voice=voice,
+                    on_progress=lambda done, total: progress.progress(done / total)
+                )
+                progress.empty()
+                # Un único read: el reproductor y la descarga comparten los mismos bytes
+                audio_bytes = audio_file.read_bytes()
+                
+                # Reproducir el audio en la interfaz
+                st.audio(audio_bytes, format='audio/mp3')
+                
+                # Opción para descargar el audio
+                st.download_button(
+                    label="Descargar audio",
+                    data=audio_bytes,
+                    file_name=f"tour_audio_{voice}.mp3",
+                    mime="audio/mp3"
+                )
+                
+            except Exception as e:
+                st.error(f"Error al generar el audio: {str(e)}")
+                logger.error("Error en generate_and_play_audio: %s", e)
+                raise